@@ -11,14 +11,56 @@ import subprocess as sub
 import re
 import os
 import json
-from sympy import sympify
+import math
+import hashlib
+import functools
+import copy
+import itertools
+import importlib.util
+import importlib.machinery
+import shutil
+import tempfile
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from sympy import sympify, lambdify, preorder_traversal, Float, IndexedBase, Matrix, Symbol
+from sympy.printing.pycode import pycode
+from sympy.printing.c import ccode
 from scipy.integrate import odeint
 import numpy as np
+from six import string_types
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import cffi
+except ImportError:
+    cffi = None
+
+# A line of iSAT output either names a variable, or gives the interval containing its value
+_ISAT_LINE = re.compile(r"(?P<name>.+?) \(.+?\):|.+?[\[\(](?P<lo>.+?),(?P<hi>.+?)[\]\)].+")
+# A line of a dReach proof file gives the interval containing the value of a variable
+_DREAL_LINE = re.compile(r"\t([A-Za-z_0-9]+) : [\[\(]([\d.]+?), ([\d.]+?)[\]\)]")
+
+
+@functools.lru_cache(maxsize=None)
+def _sym(name):
+    """
+    Convert a variable name to the corresponding SymPy object, caching the result so that each name is only parsed once.
+    """
+    return sympify(name)
 
-import matplotlib as mpl
-mpl.use('Agg')
-import matplotlib.pyplot as plt
-import random
 
 class SolverCaller(object):
     """
@@ -38,6 +80,25 @@ class SolverCaller(object):
         if not os.path.exists(self.results_dir):
             os.makedirs(self.results_dir)
 
+        self._rhs_cache = {}
+
+        # if True, the flow is compiled to C (requires cffi and a C compiler) rather than to python/numba
+        self.compile_to_c = False
+
+        # maximum number of lines of solver output retained in memory for parsing (in total, across all output files),
+        # and the retained output
+        self.output_buffer_lines = 20000
+        self._solver_output = OrderedDict()
+        self._solver_output_lock = threading.Lock()
+
+        # solver results are cached, keyed by the contents of the model file and the command used to run the solver
+        self.use_cache = True
+        self.cache_dir = os.path.join(self.results_dir, ".cache")
+
+        # lines replaced by replace_model_lines are padded to this width, so they can later be overwritten in place
+        self.replaced_line_width = 40
+        self._replaced_line_offsets = None
+
     def single_synthesis(self, cost=20, precision=0.01, msw=0, max_depth=False):
         """
         Call the solver once to synthesize a single system. Interpretation of precision and msw depends on which solver
@@ -56,6 +117,250 @@ class SolverCaller(object):
     def optimal_synthesis_decreasing_cost(self, max_cost=35, min_cost=10, precision=0.1):
         pass
 
+    def synthesize_costs(self, costs, solve, max_workers=None):
+        """
+        Solve the problem once for each permitted cost, with the solver calls running in parallel.
+
+        Each call is made on a shallow copy of this object whose ``model_path`` points to a private copy of the model
+        file, so that the cost written by ``edit_cost`` for one call does not affect any other. The original model file
+        is not modified.
+
+        The copies are made from a template that has already been patched once by ``edit_cost``, so that the offsets
+        of the lines it replaces are known and each copy can be patched in place.
+
+        :param costs: list of maximum permitted costs
+        :param solve: function taking a ``SolverCaller`` and a cost, which updates the cost and calls the solver
+        :param max_workers: maximum number of solvers run at once (defaults to the number of CPUs)
+        :return: list of values returned by ``solve``, in the same order as ``costs``
+        """
+        work_dir = tempfile.mkdtemp()
+        try:
+            template = copy.copy(self)
+            template.model_path = os.path.join(work_dir, os.path.basename(self.model_path))
+            template._replaced_line_offsets = None
+            shutil.copyfile(self.model_path, template.model_path)
+            if costs:
+                template.edit_cost(costs[0])
+
+            callers = []
+            for i, cost in enumerate(costs):
+                caller = copy.copy(template)
+                caller.model_path = os.path.join(work_dir, str(i), os.path.basename(self.model_path))
+                os.makedirs(os.path.dirname(caller.model_path))
+                shutil.copyfile(template.model_path, caller.model_path)
+                if template._replaced_line_offsets is not None:
+                    # the copy has the same byte layout as the template, so the recorded offsets apply to it too
+                    _, size, offsets = template._replaced_line_offsets
+                    caller._replaced_line_offsets = (caller.model_path, size, offsets)
+                callers.append(caller)
+
+            # each task spends its time waiting for a solver subprocess, so threads are sufficient
+            with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+                futures = [executor.submit(solve, caller, cost) for caller, cost in zip(callers, costs)]
+                return [future.result() for future in futures]
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def run_solver(self, command, out_file, products=()):
+        """
+        Run a solver, writing its standard output to a file as it is produced.
+
+        The last ``output_buffer_lines`` lines of output are also kept in memory and returned. If this is the complete
+        output, it can be parsed without reading the file back.
+
+        If the solver has previously been run with the same command on an identical model file, its cached output is
+        copied to ``out_file`` instead, and the solver is not called. Output is only cached if the solver exits
+        successfully, and products are only cached if this run wrote them.
+
+        :param command: command used to run the solver
+        :param out_file: path of file to which solver output should be written
+        :param products: paths of any other files written by the solver, which should also be cached
+        :return: ``(lines, complete)``, where lines is a deque of the retained lines of output (None if the output was
+            taken from the cache)
+        """
+        key = None
+        if self.use_cache:
+            # the model may be a temporary copy, so its location should not affect the key
+            with open(self.model_path, "rb") as f:
+                key = hashlib.blake2b(f.read() + command.replace(self.model_path, self.model_name).encode()).hexdigest()
+
+            cached_output = os.path.join(self.cache_dir, "%s.txt" % key)
+            if os.path.exists(cached_output):
+                print("Using cached solver output for\n " + command)
+                shutil.copyfile(cached_output, out_file)
+                for product in products:
+                    cached_product = os.path.join(self.cache_dir, "%s-%s" % (key, os.path.basename(product)))
+                    if os.path.exists(cached_product):
+                        shutil.copyfile(cached_product, product)
+                return None, False
+
+        # record the state of any existing products, so that stale files left by an earlier run are not cached
+        previous_products = dict((product, self._modification_time(product)) for product in products)
+
+        lines = deque(maxlen=self.output_buffer_lines)
+
+        with open(out_file, "w") as f, open(os.devnull, "w") as devnull:
+            print("Calling solver!\n " + command)
+            p = sub.Popen(command.split(), stdout=sub.PIPE, stderr=devnull, bufsize=1, universal_newlines=True)
+            for line in p.stdout:
+                f.write(line)
+                lines.append(line)
+            p.stdout.close()
+            returncode = p.wait()
+
+        if returncode != 0:
+            print("Solver exited with status %s; its output will not be cached" % returncode)
+        elif key:
+            for product in products:
+                modified = self._modification_time(product)
+                if modified is not None and modified != previous_products[product]:
+                    self._add_to_cache(product, "%s-%s" % (key, os.path.basename(product)))
+            self._add_to_cache(out_file, "%s.txt" % key)
+
+        return lines, len(lines) < self.output_buffer_lines
+
+    @staticmethod
+    def _modification_time(file_path):
+        """
+        Return the modification time of a file in nanoseconds, or None if it does not exist.
+        """
+        try:
+            return os.stat(file_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _add_to_cache(self, file_path, cache_name):
+        """
+        Copy a file into the cache directory. The copy is renamed into place, so that a partially written file is never
+        visible to another process reading the cache.
+        """
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+        os.close(fd)
+        shutil.copyfile(file_path, tmp_path)
+        os.replace(tmp_path, os.path.join(self.cache_dir, cache_name))
+
+    def clear_cache(self):
+        """
+        Delete all cached solver output.
+        """
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def retain_solver_output(self, out_file, lines):
+        """
+        Keep solver output in memory so that it can be parsed by ``read_solver_output`` without reading ``out_file``.
+
+        Any output previously retained for ``out_file`` is discarded. If ``lines`` is None, nothing new is retained. The
+        oldest retained output is dropped once more than ``output_buffer_lines`` lines are held in total.
+
+        :param out_file: path of the file to which the solver output was written
+        :param lines: lines of solver output, or None
+        """
+        with self._solver_output_lock:
+            self._solver_output.pop(out_file, None)
+            if lines is None:
+                return
+
+            self._solver_output[out_file] = lines
+            total = sum(len(retained) for retained in self._solver_output.values())
+            while total > self.output_buffer_lines:
+                _, dropped = self._solver_output.popitem(last=False)
+                total -= len(dropped)
+
+    def read_solver_output(self, file_path):
+        """
+        Iterate over the lines of solver output saved in ``file_path``, using the copy retained in memory by
+        ``call_solver`` if there is one.
+
+        :param file_path: path to the file containing solver output
+        """
+        with self._solver_output_lock:
+            lines = self._solver_output.pop(file_path, None)
+        if lines is not None:
+            for line in lines:
+                yield line
+            return
+
+        with open(file_path, "r") as f:
+            for line in f:
+                yield line
+
+    def replace_model_lines(self, replacements):
+        """
+        Replace the first line of the model file that contains each of the keys of ``replacements`` with the
+        corresponding value, padded to ``replaced_line_width`` characters.
+
+        The first call rewrites the whole file, recording the byte offset of each replaced line. Subsequent calls
+        overwrite those lines in place, provided that the file has not changed size and each offset still holds a line
+        of the same length containing the same key.
+
+        :param replacements: dictionary in which keys are strings identifying lines, and values are replacement lines
+        """
+        new_lines = dict((marker, line.ljust(self.replaced_line_width).encode())
+                         for marker, line in replacements.items())
+
+        if self._replace_model_lines_in_place(new_lines):
+            return
+
+        offsets = {}
+        output = []
+        position = 0
+        with open(self.model_path, 'rb') as f:
+            for line in f:
+                content = line.rstrip(b"\r\n")
+                for marker, new_line in new_lines.items():
+                    if marker.encode() in content:
+                        offsets.setdefault(marker, []).append((position, len(new_line)))
+                        line = new_line + line[len(content):]
+                        break
+
+                output.append(line)
+                position += len(line)
+
+                # the defines are usually near the top of the file, so copy the rest once they have all been found
+                if len(offsets) == len(new_lines):
+                    rest = f.read()
+                    output.append(rest)
+                    position += len(rest)
+                    break
+
+        with open(self.model_path, 'wb') as f:
+            f.write(b"".join(output))
+
+        self._replaced_line_offsets = (self.model_path, position, offsets)
+
+    def _replace_model_lines_in_place(self, new_lines):
+        """
+        Overwrite lines at the offsets recorded by ``replace_model_lines``, if they are still valid.
+
+        :return: True if the lines were replaced, False if the file must be rewritten instead
+        """
+        if self._replaced_line_offsets is None:
+            return False
+
+        path, size, offsets = self._replaced_line_offsets
+        if path != self.model_path or set(offsets) != set(new_lines) or os.path.getsize(path) != size:
+            return False
+
+        with open(path, 'r+b') as f:
+            for marker, positions in offsets.items():
+                for position, length in positions:
+                    f.seek(position)
+                    data = f.read(length + 1)
+                    # the recorded line must still end exactly where the new one will (at a line break or end of file)
+                    if length != len(new_lines[marker]) or marker.encode() not in data[:length] \
+                            or data[length:] not in (b"", b"\n", b"\r"):
+                        return False
+
+            for marker, positions in offsets.items():
+                for position, length in positions:
+                    f.seek(position)
+                    f.write(new_lines[marker])
+
+        return True
+
     def simulate_solutions(self, initial_conditions, parametrised_flow, t=False, plot_name="", hidden_variables="", mode_times=None, lna=False):
         """
         Numerically integrates the system using ``scipy.odeint`` to obtain a simulated time-course.
@@ -66,6 +371,7 @@ class SolverCaller(object):
         :param parametrised_flow: dictionary in which keys are species names, and values are SympPy expressions for their time derivatives
         :param t: vector of times at which the system state will be calculated
         :param plot_name: name of file in which plot of results should be saved
+        :param hidden_variables: names of species that should not be plotted (list, or comma-separated string)
         :return:
         """
         if t is False:
@@ -75,66 +381,185 @@ class SolverCaller(object):
             mode_times = []
 
 
-        ic = []
-        species_list = parametrised_flow.keys()
-        for i, species in enumerate(species_list):
-            ic.append(initial_conditions[str(species)])
+        species_tuple = tuple(parametrised_flow.keys())
+        variable_names = [str(species) for species in species_tuple]
+        ic = [initial_conditions[name] for name in variable_names]
 
-        sol = odeint(self.gradient_function, ic, t, args=(parametrised_flow,species_list))
-        variable_names = [str(x) for x in parametrised_flow]
+        rhs, jacobian, P = self.compile_flow(parametrised_flow, species_tuple)
+        derivatives = np.empty(len(species_tuple))
+        # odeint bounds the number of steps (mxstep), so a system that blows up produces a warning rather than hanging
+        sol = odeint(self.gradient_function, ic, t, args=(rhs, P, derivatives), Dfun=lambda t, X, *args: jacobian(t, X, P),
+                     tfirst=True, rtol=1e-4, atol=1e-6)
 
         if not hidden_variables:
             hidden_variables = []
-        variables_to_keep = np.array(map(lambda v: v not in hidden_variables and not 'var' in v and not 'cov' in v, variable_names))
-        lna_to_keep = np.array(map(lambda v: v not in hidden_variables and 'var' in v, variable_names))
+        names = np.asarray(variable_names, dtype=str)
+        if isinstance(hidden_variables, string_types):
+            # hidden variables may be given as a comma-separated string
+            hidden_variables = hidden_variables.split(',')
+        hidden = set(name.strip() for name in hidden_variables)
+        mask_hidden = np.array([n not in hidden for n in variable_names], dtype=bool)
+        mask_var = np.char.find(names, 'var') < 0
+        mask_cov = np.char.find(names, 'cov') < 0
+        variables_to_keep = mask_hidden & mask_var & mask_cov
         if plot_name:
-            plt.figure()
-            lines = plt.plot(t, sol[:, variables_to_keep])
+            # the figure is not registered with pyplot, so it is freed once it goes out of scope
+            fig = Figure()
+            ax = fig.subplots()
+            kept = sol[:, variables_to_keep]
+            lines = ax.plot(t, kept)
             if lna:
-                lna = plt.fill_between(t, (sol[:, variables_to_keep] + sol[:,lna_to_keep]).flatten(), (sol[:, variables_to_keep] - sol[:,lna_to_keep]).flatten(),
-                            alpha=1, edgecolor='#3F7F4C', facecolor='#7EFF99',
-                            linewidth=0)
-            plt.legend(iter(lines), np.array(variable_names)[variables_to_keep])
+                # each species is shaded by its own variance column ('var' + name), looked up by name since the
+                # order of the flow is arbitrary; species without a variance column are not shaded
+                columns = dict((name, i) for i, name in enumerate(variable_names))
+                for name in names[variables_to_keep]:
+                    if 'var' + name not in columns:
+                        continue
+                    value = sol[:, columns[name]]
+                    spread = sol[:, columns['var' + name]]
+                    ax.fill_between(t, value + spread, value - spread,
+                                    alpha=1, edgecolor='#3F7F4C', facecolor='#7EFF99',
+                                    linewidth=0)
+            ax.legend(lines, names[variables_to_keep])
 
             if len(mode_times) > 0:
                 mode_times.append(t[-1])
                 mode_times = [ float(x) for x in mode_times]
                 mode_times.sort()
+                # pale colours, drawn with a fixed seed so that plots are reproducible
+                colors = np.random.default_rng(0).uniform([0.5, 0.6, 0.6], [1, 1, 1], size=(len(mode_times), 3))
                 #for time in mode_times:
                 for x in range(1, len(mode_times)):
-                    #plt.axvline(x=time, color='k')
-                    r = float(random.randrange(50,100))/100
-                    g = float(random.randrange(60,100))/100
-                    b = float(random.randrange(60,100))/100
-                    plt.axvspan(mode_times[x-1],mode_times[x], alpha=0.5, color=(r,g,b), label='mode_' + str(x))
-            plt.xlabel("Time")
-            plt.savefig(plot_name + "-simulation.png")
+                    #ax.axvline(x=time, color='k')
+                    ax.axvspan(mode_times[x-1],mode_times[x], alpha=0.5, color=tuple(colors[x]), label='mode_' + str(x))
+            ax.set_xlabel("Time")
+            FigureCanvasAgg(fig).print_png(plot_name + "-simulation.png")
 
         return t, sol, variable_names
 
-    @staticmethod
-    def gradient_function(X, t, flow, species_list):
+    def compile_flow(self, parametrised_flow, species_list):
         """
-        Evaluates the time-derivative of the system so that it can be numerically integrated by
-        ``scipy.odeint`` to obtain a simulated time-course.
+        Convert the flow into a single python function ``rhs(t, X, P, dX)``, which writes the time-derivatives into the
+        array ``dX`` and returns it. If numba is installed, this function is JIT-compiled to native code.
 
-        :param X: vector of current concentrations (in order given by species_list)
-        :param t: current time (ignored, as not needed to evaluate derivatives)
-        :param flow: dictionary in which keys are species-names, and values are SympPy expressions for their time derivatives
-        :param species_list: list of species names (SymPy objects)
-        :return:
+        The numerical constants in the flow (the parameter values substituted by ``get_full_solution``) are replaced by
+        elements of the array ``P``, so that flows differing only in their parameter values share the same compiled
+        function.
+
+        The Jacobian of the flow is also computed symbolically, and lambdified into a function ``jacobian(t, X, P)``, so
+        that the integrator does not need to estimate it by finite differences.
+
+        If ``compile_to_c`` is set, ``rhs`` is instead a wrapper around a C function, as returned by ``compile_c_flow``.
+
+        Compiled functions are cached, so repeatedly simulating flows with the same structure only incurs the
+        compilation cost once.
+
+        :param parametrised_flow: dictionary in which keys are species names, and values are SympPy expressions for their time derivatives
+        :param species_list: list of species names (SymPy objects), giving the order of elements in ``X``
+        :return: tuple ``(rhs, jacobian, P)``, where ``P`` is the array of constants for this flow
+        """
+        constants = {}
+        parameter_symbols = []
+        values = []
+        for species in species_list:
+            for atom in preorder_traversal(parametrised_flow[species]):
+                if isinstance(atom, Float) and atom not in constants:
+                    constants[atom] = Symbol('_p%d' % len(values))
+                    parameter_symbols.append(constants[atom])
+                    values.append(float(atom))
+
+        P = np.array(values, dtype=float)
+        structure = [parametrised_flow[species].xreplace(constants) for species in species_list]
+
+        key = (self.compile_to_c, tuple(str(species) for species in species_list), tuple(str(e) for e in structure))
+        if key in self._rhs_cache:
+            rhs, jacobian = self._rhs_cache[key]
+            return rhs, jacobian, P
+
+        X = IndexedBase('X', shape=(len(species_list),))
+        P_base = IndexedBase('P', shape=(max(len(constants), 1),))
+        positions = dict((sympify(species), X[i]) for i, species in enumerate(species_list))
+        positions.update((symbol, P_base[i]) for i, symbol in enumerate(parameter_symbols))
+        expressions = [expression.xreplace(positions) for expression in structure]
+
+        if self.compile_to_c:
+            rhs = self.compile_c_flow(expressions)
+        else:
+            source = "def rhs(t, X, P, dX):\n"
+            for i, expression in enumerate(expressions):
+                source += "    dX[%d] = %s\n" % (i, pycode(expression))
+            source += "    return dX\n"
+            namespace = {"math": math}
+            exec(source, namespace)
+            rhs = namespace["rhs"]
+
+            if njit is not None:
+                rhs = njit(fastmath=True)(rhs)
+
+        syms = [sympify(species) for species in species_list]
+        J = Matrix(structure).jacobian(syms)
+        jacobian = lambdify([Symbol('t'), syms, parameter_symbols], J, modules='numpy')
+
+        self._rhs_cache[key] = (rhs, jacobian)
+        return rhs, jacobian, P
+
+    def compile_c_flow(self, expressions):
+        """
+        Compile time-derivatives to a C function ``rhs(double t, const double *X, const double *P, double *dX)`` using
+        cffi, and return a python wrapper around it with the same signature as the functions generated by
+        ``compile_flow``.
+
+        Compiled modules are stored in the cache directory, named by a hash of their C source, so that each flow is only
+        compiled once.
+
+        :param expressions: list of SymPy expressions for the time-derivatives, in terms of ``t``, ``X[i]`` and ``P[j]``
+        :return: function taking the current time, vector of current concentrations, constants, and array for the
+            derivatives
         """
-        vals = {"t": t}
+        if cffi is None:
+            raise ImportError("cffi is required to compile the flow to C")
+
+        source = "#include <math.h>\n\nvoid rhs(double t, const double *X, const double *P, double *dX)\n{\n"
+        for i, expression in enumerate(expressions):
+            source += "    dX[%d] = %s;\n" % (i, ccode(expression))
+        source += "}\n"
+
+        module_name = "_crn_rhs_%s" % hashlib.blake2b(source.encode(), digest_size=16).hexdigest()
+        build_dir = os.path.join(self.cache_dir, "rhs")
+
+        module_path = os.path.join(build_dir, module_name + importlib.machinery.EXTENSION_SUFFIXES[0])
+        if not os.path.exists(module_path):
+            builder = cffi.FFI()
+            builder.cdef("void rhs(double t, const double *X, const double *P, double *dX);")
+            builder.set_source(module_name, source, libraries=["m"])
+            module_path = builder.compile(tmpdir=build_dir)
 
-        for i, species in enumerate(species_list):
-            vals[species] = X[i]
+        spec = importlib.util.spec_from_file_location(module_name, module_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        ffi, lib = module.ffi, module.lib
 
-        result = []
+        def rhs(t, X, P, dX):
+            lib.rhs(t, ffi.from_buffer("double[]", np.ascontiguousarray(X, dtype=float)),
+                    ffi.from_buffer("double[]", P), ffi.from_buffer("double[]", dX))
+            return dX
 
-        for species in flow:
-            result.append(flow[species].evalf(subs=vals))
+        return rhs
 
-        return result
+    @staticmethod
+    def gradient_function(t, X, rhs, P, dX):
+        """
+        Evaluates the time-derivative of the system so that it can be numerically integrated by
+        ``scipy.odeint`` (called with ``tfirst=True``) to obtain a simulated time-course.
+
+        :param t: current time
+        :param X: vector of current concentrations (in order given by species_list)
+        :param rhs: compiled flow, as returned by ``compile_flow``
+        :param P: array of constants in the flow, as returned by ``compile_flow``
+        :param dX: array into which the derivatives are written, reused between calls to avoid allocating a new one
+        :return:
+        """
+        return rhs(t, X, P, dX)
 
 
     def get_full_solution(self, crn, flow, vals, scale_factor=1):
@@ -151,23 +576,27 @@ class SolverCaller(object):
 
         var_names = [str(var) for var in flow.keys()]
 
+        parameter_values = {}
         for val in vals:
             if val == "time":
                 continue
 
+            mean_val = (float(vals[val][0]) + float(vals[val][1])) / 2
             if val in var_names:
-                initial_conditions[val] = (float(vals[val][0]) + float(vals[val][1])) / 2
+                initial_conditions[val] = mean_val
             else:
-                for x in flow:
-                    mean_val = (float(vals[val][0]) + float(vals[val][1])) / 2
-                    flow[x] = flow[x].subs(sympify(val), mean_val)
+                parameter_values[_sym(val)] = Float(mean_val)
+
+        # the scale factor is substituted in the same pass, unless the solver reported a value for it
+        parameter_values.setdefault(_sym('SF'), Float(scale_factor))
 
+        # substitute all parameters in a single pass over each expression
         for x in flow:
-            flow[x] = flow[x].subs(sympify('SF'), scale_factor)
+            flow[x] = flow[x].xreplace(parameter_values)
 
         parametrised_flow = dict(flow)
         for x in crn.derivatives:
-            derivative_symbol = sympify(x["name"])
+            derivative_symbol = _sym(x["name"])
             del parametrised_flow[derivative_symbol]
             # del initial_conditions[str(derivative_symbol)]
 
@@ -193,49 +622,46 @@ class SolverCallerISAT(SolverCaller):
         if not self.num_modes:
             self.num_modes = 2
 
-    def optimal_synthesis_decreasing_cost(self, max_cost=35, min_cost=10, precision=0.1, msw=0, max_depth=False):
+    def optimal_synthesis_decreasing_cost(self, max_cost=35, min_cost=10, precision=0.1, msw=0, max_depth=False, max_workers=None):
         """
-        Call iSAT repeatedly, decreasing the permitted cost by 1 between each iteration.
+        Call iSAT for each permitted cost from max_cost down to min_cost, decreasing by 1 between iterations. The
+        iterations are independent, so iSAT is run for several costs in parallel.
 
         :param max_cost: the maximum cost permitted on the first iteration
         :param min_cost: the maximum cost permitted on the final iteration
         :param precision: value of --prabs parameter to eb passed to iSAT
         :param msw: value of --msw parameter to eb passed to iSAT
+        :param max_workers: maximum number of copies of iSAT to run at once (defaults to the number of CPUs)
         :return: list of file names, each containing the output from iSAT from one iteration
         """
         cost = max_cost
-        result_file_names = []
+        costs = []
 
         if not max_depth:
             max_depth = self.num_modes
 
         while cost >= min_cost:
-            self.edit_cost(cost)
-            result_file_name = self.call_solver(precision, cost, ' --ode-opts --continue-after-not-reaching-horizon', msw=msw, max_depth=max_depth)
-            result_file_names.append(result_file_name)
+            costs.append(cost)
             cost -= 1
-        return result_file_names
+
+        def solve(caller, cost):
+            caller.edit_cost(cost)
+            return caller.call_solver(precision, cost, ' --ode-opts --continue-after-not-reaching-horizon', msw=msw, max_depth=max_depth)
+
+        return self.synthesize_costs(costs, solve, max_workers=max_workers)
 
     def edit_cost(self, cost):
         """
         Edit the model file to update the MAX_COST limit.
         :param cost: maximum permitted cost - 0 means no limit applied (float)
         """
-        with open(self.model_path, 'r') as f:
-            lines = f.read().split('\n')
-
-            for line_number, line in enumerate(lines):
-                if "define MAX_COST = " in line:
-                    lines[line_number] = "define MAX_COST = %s; " % cost
+        if cost == 0:
+            no_cost_limit = "define NO_COST_LIMIT = 1;"
+        else:
+            no_cost_limit = "define NO_COST_LIMIT = 0;"
 
-                if "define NO_COST_LIMIT = " in line:
-                    if cost == 0:
-                        lines[line_number] = "define NO_COST_LIMIT = 1;"
-                    else:
-                        lines[line_number] = "define NO_COST_LIMIT = 0;"
-
-        with open(self.model_path, 'w') as f:
-            f.write('\n'.join(lines))
+        self.replace_model_lines({"define MAX_COST = ": "define MAX_COST = %s;" % cost,
+                                  "define NO_COST_LIMIT = ": no_cost_limit})
 
     def call_solver(self, precision, cost, otherPrams, max_depth=False, msw=0):
         """
@@ -259,9 +685,12 @@ class SolverCallerISAT(SolverCaller):
         command = "%s --i %s --prabs=%s --msw=%s --max-depth=%s %s " % (self.isat_path, self.model_path, precision, msw, max_depth, otherPrams)
 
 
-        with open(out_file, "w") as f:
-            print("Calling solver!\n " + command)
-            sub.call(command.split(), stdout=f, stderr=sub.PIPE)
+        # output retained from an earlier run would no longer match the file
+        self.retain_solver_output(out_file, None)
+
+        lines, complete = self.run_solver(command, out_file)
+        if complete:
+            self.retain_solver_output(out_file, lines)
 
         return out_file
 
@@ -276,38 +705,37 @@ class SolverCallerISAT(SolverCaller):
         :param file_path: path to the file containing iSAT output
         """
 
-        p = re.compile(r"(.+?) \(.+?\):")
-        p2 = re.compile(r".+?[\[\(](.+?),(.+?)[\]\)].+")
-
         constant_values = {}
         all_values = {} # includes state variables
         all_values["time"] = []
 
         var_name = False
-        with open(file_path, "r") as f:
-            for line in f:
+        for line in self.read_solver_output(file_path):
+            m = _ISAT_LINE.match(line)
+            if not m:
+                continue
 
-                if p.match(line):
-                    var_name = p.match(line).groups()[0].strip()
+            if m.group("name") is not None:
+                var_name = m.group("name").strip()
 
-                    if "solver" in var_name or "_trigger" in var_name or var_name == "inputTime":
-                        var_name = False
+                if "solver" in var_name or "_trigger" in var_name or var_name == "inputTime":
+                    var_name = False
 
-                elif p2.match(line) and var_name:
-                    values = p2.match(line).groups()
+            elif var_name:
+                values = m.group("lo", "hi")
 
-                    if var_name == "time":
-                        all_values["time"].append(values[1])
+                if var_name == "time":
+                    all_values["time"].append(values[1])
 
-                    elif var_name not in all_values.keys():
-                        # this is the first value encountered for this variable
-                        constant_values[var_name] = values
-                        all_values[var_name] = values
+                elif var_name not in all_values.keys():
+                    # this is the first value encountered for this variable
+                    constant_values[var_name] = values
+                    all_values[var_name] = values
 
-                    elif var_name in constant_values.keys() and constant_values[var_name] != values:
-                        # if we've already recorded a different value, it's because value changes between modes
-                        # it's not a constant parameter, so don't record it
-                        constant_values.pop(var_name, None)
+                elif var_name in constant_values.keys() and constant_values[var_name] != values:
+                    # if we've already recorded a different value, it's because value changes between modes
+                    # it's not a constant parameter, so don't record it
+                    constant_values.pop(var_name, None)
 
         #mode_times = {}
         #for i, time in enumerate(all_values["time"]):
@@ -362,22 +790,13 @@ class SolverCallerDReal(SolverCaller):
         Edit the model file to update the MAX_COST limit.
         :param cost: maximum permitted cost - 0 means no limit applied (float)
         """
+        if cost == 0:
+            no_cost_limit = "#define NO_COST_LIMIT 1"
+        else:
+            no_cost_limit = "#define NO_COST_LIMIT 0"
 
-        with open(self.model_path, 'r') as f:
-            lines = f.read().split('\n')
-
-            for line_number, line in enumerate(lines):
-                if "define MAX_COST = " in line:
-                    lines[line_number] = "#define MAX_COST %s" % cost
-
-                if "define NO_COST_LIMIT = " in line:
-                    if cost == 0:
-                        lines[line_number] = "#define NO_COST_LIMIT 1"
-                    else:
-                        lines[line_number] = "#define NO_COST_LIMIT 0;"
-
-        with open(self.model_path, 'w') as f:
-            f.write('\n'.join(lines))
+        self.replace_model_lines({"#define MAX_COST": "#define MAX_COST %s" % cost,
+                                  "#define NO_COST_LIMIT": no_cost_limit})
 
     def call_solver(self, precision, cost, otherPrams, max_depth=False):
         """
@@ -397,12 +816,12 @@ class SolverCallerDReal(SolverCaller):
         command = "%s -k %s %s --precision %s --proof %s" % \
                   (self.dreal_path, max_depth, self.model_path, precision, otherPrams)
 
-        with open(out_file, "w") as f:
-            print("Calling solver!\n " + command)
-            sub.call(command.split(), stdout=f, stderr=sub.PIPE)
-
         # dREach
-        return os.path.join(os.getcwd(), "%s_%s_0.smt2.proof" % (self.model_name, self.num_modes - 1))
+        proof_file = os.path.join(os.getcwd(), "%s_%s_0.smt2.proof" % (self.model_name, self.num_modes - 1))
+
+        self.run_solver(command, out_file, products=[proof_file])
+
+        return proof_file
 
     def getCRNValues(self, file_path):
         """
@@ -414,8 +833,6 @@ class SolverCallerDReal(SolverCaller):
         :param file_path: path to the file containing dReach output
         """
 
-        p = re.compile(r"\t([A-Za-z_0-9]+) : [\[\(]([\d.]+?), ([\d.]+?)[\]\)]")
-
         constant_values = {}
         all_values = {} # includes state variables
         all_values["time"] = []
@@ -423,9 +840,9 @@ class SolverCallerDReal(SolverCaller):
 
         with open(file_path, "r") as f:
             for line in f:
-
-                if p.match(line):
-                    groups = p.match(line).groups()
+                m = _DREAL_LINE.match(line)
+                if m:
+                    groups = m.groups()
 
                     var_name = groups[0].strip()
                     var_name = "_".join(var_name.split("_")[:-2])
@@ -455,7 +872,7 @@ class SolverCallerDReal(SolverCaller):
                         # if we've already recorded a different value, it's because value changes between modes
                         # it's not a constant parameter, so don't record it
                         constant_values.pop(var_name, None)
-        print constant_values, all_values
+        print(constant_values, all_values)
         return constant_values, all_values
 
 
@@ -470,14 +887,10 @@ class SolverCallerDReal(SolverCaller):
         :param file_path: path to the file containing dReach output
         """
 
-        results = ''
-        with open(file_path) as f:
-            results = json.load(f)
-
         constant_values = {}
         all_values = {}  # includes state variables
 
-        for t in results["traces"][0]:
+        for t in self.read_first_json_trace(file_path):
             var_name = "_".join(t["key"].split("_")[:-2])
             
             # Mode transition times contain only a single underscore (e.g. time_0)
@@ -486,16 +899,33 @@ class SolverCallerDReal(SolverCaller):
 
             interval = t["values"][0]["enclosure"]
 
-            single_value = True
-
-            for v in t["values"]:
-                # if i[0] != interval[0] or i[1] != interval[1] :
-                if v["enclosure"] != interval:
-                    single_value = False
-                    break
+            single_value = all(v["enclosure"] == interval for v in t["values"])
 
             if single_value:
                 constant_values[var_name] = interval
             all_values[var_name] = interval
 
         return constant_values, all_values
+
+    @staticmethod
+    def read_first_json_trace(file_path):
+        """
+        Iterate over the variables in the first trace of a ``.smt2.json`` file written by dReach.
+
+        If ijson is installed, the file is parsed incrementally and parsing stops at the end of the first trace, so
+        the rest of the file is never loaded into memory.
+
+        :param file_path: path to the file containing dReach output
+        """
+        if ijson is None:
+            with open(file_path) as f:
+                results = json.load(f)
+            for t in results["traces"][0]:
+                yield t
+            return
+
+        with open(file_path, "rb") as f:
+            events = ijson.parse(f, use_float=True)
+            first_trace = itertools.takewhile(lambda e: not (e[0] == "traces.item" and e[1] == "end_array"), events)
+            for t in ijson.items(first_trace, "traces.item.item"):
+                yield t
@@ -9,5 +9,7 @@ setup(name='CRNSynthesis',
       author_email='',
       url='',
       packages=['CRNSynthesis'],
-      install_requires=['sympy', 'scipy', 'matplotlib', 'six']
+      install_requires=['sympy', 'scipy', 'matplotlib', 'six'],
+      extras_require={'jit': ['numba'], 'streaming': ['ijson'], 'c': ['cffi']},
+      python_requires='>=3.6'
       )